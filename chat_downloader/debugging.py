@@ -53,6 +53,12 @@ def debug_log(*items):
     log('debug', items, True, True)
 
 
+def debug_enabled():
+    """Return True if a call to debug_log would have any effect. This allows
+    callers to skip building debugging information on hot paths."""
+    return TESTING_MODE != TestingModes.NONE or logger.isEnabledFor(log_module.DEBUG)
+
+
 try:
     import colorama
     colorama.init()
@@ -19,7 +19,8 @@ from ..utils.core import (
     get_title_of_webpage,
     pause,
     safe_print,
-    safe_path
+    safe_path,
+    json_loads
 )
 
 from ..utils.timed_utils import (
@@ -170,14 +171,40 @@ class Remapper():
         """
 
         info = {}
-        for key in input_dictionary:
-            Remapper.remap(
-                info, remapping_dict, key, input_dictionary[key],
+        remap = Remapper.remap
+        for key, value in input_dictionary.items():
+            remap(
+                info, remapping_dict, key, value,
                 keep_unknown_keys=keep_unknown_keys,
                 replace_char_with_underscores=replace_char_with_underscores
             )
         return info
 
+    @staticmethod
+    def flatten_dict(remapping_dict):
+        """Convert a remapping dictionary to one which maps each key to a
+        (new_key, remap_function, to_unpack) tuple. Flattened dictionaries
+        can be applied directly in hot loops, without needing to check the
+        type of each remapping.
+
+        :param remapping_dict: Dictionary of remappings
+        :type remapping_dict: dict
+        :raises ValueError: if an unknown remapping is specified
+        :return: Flattened dictionary of remappings
+        :rtype: dict
+        """
+        flattened = {}
+        for key, remap in remapping_dict.items():
+            if isinstance(remap, Remapper):
+                flattened[key] = (
+                    remap.new_key, remap.remap_function, remap.to_unpack)
+            elif isinstance(remap, str):
+                flattened[key] = (remap, None, False)
+            else:
+                raise ValueError('Unknown remapping specified.')
+
+        return flattened
+
 
 class SiteDefault:
     """Allows for sites to specify default parameters. Additionally, different
@@ -395,7 +422,14 @@ class BaseChatDownloader:
     ]
 
     @staticmethod
-    def _must_add_item(item, message_groups_dict, messages_groups_to_add, messages_types_to_add):
+    def _get_valid_message_types(message_groups_dict, messages_groups_to_add, messages_types_to_add):
+        """Get the set of message types which should be added. Since this
+        depends only on the parameters, callers which check many items should
+        compute it once and test each item's type against the result.
+
+        :return: The valid message types, or None if all types are valid
+        :rtype: Union[frozenset, None]
+        """
 
         # Force mutual exclusion
         if messages_types_to_add:
@@ -403,16 +437,16 @@ class BaseChatDownloader:
             messages_groups_to_add = []
 
         if 'all' in messages_groups_to_add or 'all' in messages_types_to_add:  # user wants everything
-            return True
+            return None
 
-        valid_message_types = []
+        valid_message_types = set()
         for message_group in messages_groups_to_add or []:
-            valid_message_types += message_groups_dict.get(message_group, [])
+            valid_message_types.update(
+                message_groups_dict.get(message_group, []))
 
-        for message_type in messages_types_to_add or []:
-            valid_message_types.append(message_type)
+        valid_message_types.update(messages_types_to_add or [])
 
-        return item.get('message_type') in valid_message_types
+        return frozenset(valid_message_types)
 
     def __init__(self,
                  **kwargs
@@ -509,7 +543,7 @@ class BaseChatDownloader:
 
     def _session_get_json(self, url, **kwargs):
         """Make a get request using the current session and return as JSON."""
-        return self._session_get(url, **kwargs).json()
+        return json_loads(self._session_get(url, **kwargs).content)
 
     def get_site_value(self, value):
         """Get the site's default value for a certain parameter
@@ -532,8 +566,8 @@ class BaseChatDownloader:
     @classmethod
     def matches(cls, url):
         """Used to check if a url matches any of the
-        regular expressions specified in the classes
-        `_VALID_URLS` dictionary.
+        regular expressions (or compiled patterns) specified in the
+        classes `_VALID_URLS` dictionary.
 
         :return: If a match is found, the function name and
             match object is returned, otherwise None.
@@ -541,10 +575,13 @@ class BaseChatDownloader:
         """
         for function_name, regex in cls._VALID_URLS.items():
 
+            # Regular expressions may be given as strings or precompiled
             if isinstance(regex, str):
-                match = re.search(regex, url)
-                if match:
-                    return function_name, match
+                regex = re.compile(regex)
+
+            match = regex.search(url)
+            if match:
+                return function_name, match
 
         return None
 
@@ -668,9 +705,7 @@ class BaseChatDownloader:
     @staticmethod
     def get_mapped_keys(remapping):
         mapped_keys = set()
-        for key in remapping:
-            value = remapping[key]
-
+        for value in remapping.values():
             if isinstance(value, Remapper):
                 value = value.new_key
             mapped_keys.add(value)
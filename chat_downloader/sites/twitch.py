@@ -21,20 +21,23 @@ from ..utils.core import (
     replace_with_underscores,
     multi_get,
     remove_prefixes,
-    attempts
+    attempts,
+    json_dumps_bytes,
+    json_loads
 )
 
 from ..debugging import (
     log,
-    debug_log
+    debug_log,
+    debug_enabled
 )
 
 import re
 import json
 import time
 import socket
-import base64
 import math
+from functools import lru_cache
 from requests.exceptions import RequestException
 from json.decoder import JSONDecodeError
 
@@ -55,9 +58,19 @@ class TwitchChatIRC():
 
         # start connection
         self.socket.connect(('irc.chat.twitch.tv', 6667))
+
+        # Messages sent (e.g. PONG) are small, so send them immediately
+        # instead of waiting to coalesce them (Nagle's algorithm). Also,
+        # allow the OS to detect dead connections.
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
         # print('Connected to', self._HOST, 'on port', self._PORT)
 
         self.current_channel = None
+
+        # Received bytes which do not (yet) form a complete line
+        self._buffer = bytearray()
+
         # https://dev.twitch.tv/docs/irc/tags
         # https://dev.twitch.tv/docs/irc/membership
         # https://dev.twitch.tv/docs/irc/commands
@@ -69,10 +82,44 @@ class TwitchChatIRC():
         self.send_raw('NICK justinfan67420')
 
     def send_raw(self, string):
-        self.socket.send((string + '\r\n').encode('utf-8'))
+        self.send_bytes((string + '\r\n').encode('utf-8'))
+
+    def send_bytes(self, data):
+        """Send an already encoded (and CRLF-terminated) line."""
+        self.socket.send(data)
+
+    def recv_lines(self, buffer_size):
+        """Receive data from the socket and return all lines which have been
+        completed. Lines are only decoded once complete, so characters which
+        are split across reads are decoded correctly.
+
+        :param buffer_size: The maximum number of bytes to receive
+        :type buffer_size: int
+        :raises ConnectionError: if the connection has been closed
+        :return: List of complete lines, without line endings
+        :rtype: list
+        """
+        data = self.socket.recv(buffer_size)
+        if not data:
+            raise ConnectionError('Lost connection, reconnecting.')
+
+        buffer = self._buffer
+        buffer += data
 
-    def recv(self, buffer_size):
-        return self.socket.recv(buffer_size).decode('utf-8', 'ignore')
+        # Only the new data needs to be searched. Since a line ending may be
+        # split across reads, search for the final '\n' of the '\r\n'.
+        if b'\n' not in data:
+            return []
+
+        end = buffer.rfind(b'\r\n')
+        if end == -1:
+            return []
+
+        # All complete lines are decoded with a single call (rather than
+        # once per line), and only then split
+        complete = buffer[:end].decode('utf-8', 'ignore')
+        self._buffer = buffer[end + 2:]
+        return complete.split('\r\n')
 
     def join_channel(self, channel_name):
         channel_lower = channel_name.lower()
@@ -95,14 +142,19 @@ class TwitchChatDownloader(BaseChatDownloader):
 
     _NAME = 'twitch.tv'
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
+    def _update_badge_info(self, channel_id):
+        # Must be called before chat messages (and their badges) are parsed
+        self._update_global_badge_info()
+        self._update_subscriber_badge_info(channel_id)
 
-        # Only get badge info if not already retrieved
+    def _update_global_badge_info(self):
+        # Badge info is only needed when retrieving chat messages, so it is
+        # fetched on first use (and only once) rather than on initialisation.
         # TODO add argument (no_badges)
         if not TwitchChatDownloader._BADGE_INFO:
             TwitchChatDownloader._BADGE_INFO = self._session_get_json(
                 self._BADGE_INFO_URL).get('badge_sets') or {}
+            TwitchChatDownloader._get_badge_info.cache_clear()
 
     _TESTS = [
         # Live
@@ -175,36 +227,37 @@ class TwitchChatDownloader(BaseChatDownloader):
         'format': 'twitch',
     }
 
+    # Compiled once, when the class is created
     _VALID_URLS = {
         # e.g. 'http://www.twitch.tv/riotgames/v/6528877?t=5m10s'
-        '_get_chat_by_vod_id': r'''(?x)
+        '_get_chat_by_vod_id': re.compile(r'''(?x)
                     https?://
                         (?:
                             (?:(?:www|go|m)\.)?twitch\.tv/(?:[^/]+/v(?:ideo)?|videos)/|
                             player\.twitch\.tv/\?.*?\bvideo=v?
                         )
                         (?P<id>\d+)
-                    ''',
+                    '''),
 
         # e.g. 'https://clips.twitch.tv/FaintLightGullWholeWheat'
-        '_get_chat_by_clip_id': r'''(?x)
+        '_get_chat_by_clip_id': re.compile(r'''(?x)
                         https?://
                             (?:
                                 clips\.twitch\.tv/(?:embed\?.*?\bclip=|(?:[^/]+/)*)|
                                 (?:(?:www|go|m)\.)?twitch\.tv/[^/]+/clip/
                             )
                             (?P<id>[^/?#&]+)
-                        ''',
+                        '''),
 
         # e.g. 'http://www.twitch.tv/shroomztv'
-        '_get_chat_by_stream_id': r'''(?x)
+        '_get_chat_by_stream_id': re.compile(r'''(?x)
                         https?://
                             (?:
                                 (?:(?:www|go|m)\.)?twitch\.tv/|
                                 player\.twitch\.tv/\?.*?\bchannel=
                             )
                             (?P<id>[^/#?]+)
-                        '''
+                        ''')
     }
 
     _CLIENT_ID = 'kimne78kx3ncx6brgo4mv6wki5h1ko'  # public client id
@@ -214,6 +267,9 @@ class TwitchChatDownloader(BaseChatDownloader):
     _PING_TEXT = 'PING :tmi.twitch.tv'
     _PONG_TEXT = 'PONG :tmi.twitch.tv'
 
+    # Sent for every PING received, so only encode once
+    _PONG_BYTES = (_PONG_TEXT + '\r\n').encode('utf-8')
+
     _SUBSCRIPTION_TYPES = {
         'Prime': 'Prime',
         '1000': 'Tier 1',
@@ -240,6 +296,9 @@ class TwitchChatDownloader(BaseChatDownloader):
 
     @staticmethod
     def _parse_message_info(message):
+        if not message:  # e.g. deleted messages have a null message
+            return {}
+
         message_info = {
             'author_colour': message.get('userColor'),
             'author_badges': message.get('userBadges') or [],
@@ -272,9 +331,8 @@ class TwitchChatDownloader(BaseChatDownloader):
         message_info['message'] = message_text
 
         if emotes:
-            for emote_id in emotes:
-                emotes[emote_id]['locations'] = ','.join(
-                    emote_locations[emote_id])
+            for emote_id, emote in emotes.items():
+                emote['locations'] = ','.join(emote_locations[emote_id])
             message_info['emotes'] = list(emotes.values())
 
         return message_info
@@ -284,26 +342,31 @@ class TwitchChatDownloader(BaseChatDownloader):
         """
         Decode text according to https://ircv3.net/specs/extensions/message-tags.html
         """
+        if '\\' not in text:  # Nothing to decode (the common case)
+            return text
         return text.replace(r'\:', ';').replace(r'\s', ' ')
 
     @staticmethod
     def _generate_emote_image_list(emote_id):
+        # Only the theme and scale change between images, so build the
+        # emote-specific part of the url once
+        url_prefix = f'{TwitchChatDownloader._EMOTE_URL_BASE}{emote_id}/default/'
+
         emote_image_list = []
         for theme in ('light', 'dark'):
-            for size in ((28, '1.0'), (56, '2.0'), (112, '3.0')):
+            for size, scale in ((28, '1.0'), (56, '2.0'), (112, '3.0')):
                 image = Image(
-                    TwitchChatDownloader._EMOTE_URL_TEMPLATE.format(
-                        emote_id, theme, size[1]),
-                    size[0],
-                    size[0],
-                    f'{size[0]}x{size[0]}-{theme}'
+                    f'{url_prefix}{theme}/{scale}',
+                    size,
+                    size,
+                    f'{size}x{size}-{theme}'
                 ).json()
 
                 emote_image_list.append(image)
         return emote_image_list
 
-    _EMOTE_REGEX = r'(\w+):([\d,-]+)'
-    _EMOTE_URL_TEMPLATE = 'https://static-cdn.jtvnw.net/emoticons/v2/{}/default/{}/{}'
+    _EMOTE_REGEX = re.compile(r'(\w+):([\d,-]+)')
+    _EMOTE_URL_BASE = 'https://static-cdn.jtvnw.net/emoticons/v2/'
 
     @staticmethod
     def _parse_emotes(text):
@@ -311,7 +374,7 @@ class TwitchChatDownloader(BaseChatDownloader):
         # <emote ID>:<first index>-<last index>,<another first index>-<another last index>/<another emote ID>:<first index>-<last index>
         emotes = []
 
-        matches = re.findall(TwitchChatDownloader._EMOTE_REGEX, text)
+        matches = TwitchChatDownloader._EMOTE_REGEX.findall(text)
 
         for match in matches:
             emote_id = match[0]
@@ -345,8 +408,16 @@ class TwitchChatDownloader(BaseChatDownloader):
 
     @staticmethod
     def _parse_user(item):
+        # Called for the author of every comment. Since all user remappings
+        # are simple renames, build the dictionary directly instead of going
+        # through the generic remapping functions.
         if isinstance(item, dict):
-            return r.remap_dict(item, TwitchChatDownloader._USER_REMAPPING)
+            remapping = TwitchChatDownloader._USER_REMAPPING
+            return {
+                remapping[key]: value
+                for key, value in item.items()
+                if key in remapping
+            }
         return {}
 
     _COMMENT_REMAPPING = {
@@ -359,6 +430,7 @@ class TwitchChatDownloader(BaseChatDownloader):
         # TODO make sure body vs. fragments okay
         'message': r(None, _parse_message_info, True)
     }
+    _COMMENT_REMAPPING_FLAT = r.flatten_dict(_COMMENT_REMAPPING)
 
     _MESSAGE_PARAM_REMAPPING = {
         'msg-id': 'message_type',
@@ -383,7 +455,7 @@ class TwitchChatDownloader(BaseChatDownloader):
 
         'msg-param-should-share-streak': r('user_wants_to_share_streaks', _parse_bool),
         'msg-param-streak-months': r('number_of_consecutive_months_subscribed', int_or_none),
-        'msg-param-sub-plan': r('subscription_type', lambda x: TwitchChatDownloader._SUBSCRIPTION_TYPES.get(x)),
+        'msg-param-sub-plan': r('subscription_type', _SUBSCRIPTION_TYPES.get),
         'msg-param-sub-plan-name': r('subscription_plan_name', _decode_pseudo_BNF),
         'msg-param-sub-benefit-end-month': r('sub_benefit_end_month', int_or_none),
 
@@ -460,6 +532,7 @@ class TwitchChatDownloader(BaseChatDownloader):
     _KNOWN_COMMENT_KEYS.update(BaseChatDownloader.get_mapped_keys({
         **_COMMENT_REMAPPING, **_MESSAGE_PARAM_REMAPPING
     }))
+    _KNOWN_COMMENT_KEYS = frozenset(_KNOWN_COMMENT_KEYS)  # never modified
     # print('_KNOWN_COMMENT_KEYS',_KNOWN_COMMENT_KEYS)
 
     _IRC_REMAPPING = {
@@ -554,6 +627,9 @@ class TwitchChatDownloader(BaseChatDownloader):
         **_MESSAGE_PARAM_REMAPPING
     }
 
+    # Single lookup table for all tags (including msg-param-* tags)
+    _IRC_REMAPPING_FLAT = r.flatten_dict(_IRC_REMAPPING)
+
     _KNOWN_IRC_KEYS = {
         # banned user
         'banned_user', 'ban_type',
@@ -571,6 +647,12 @@ class TwitchChatDownloader(BaseChatDownloader):
         'message'
     }
     _KNOWN_IRC_KEYS.update(BaseChatDownloader.get_mapped_keys(_IRC_REMAPPING))
+    _KNOWN_IRC_KEYS = frozenset(_KNOWN_IRC_KEYS)  # never modified
+
+    # Keys which _move_to_dict(info, 'in_reply_to') would move. Most messages
+    # are not replies, so this lets the move be skipped for them.
+    _IRC_REPLY_KEYS = frozenset(
+        key for key in _KNOWN_IRC_KEYS if 'in_reply_to_' in key)
 
     _ACTION_TYPE_REMAPPING = {
         # tags
@@ -782,46 +864,66 @@ class TwitchChatDownloader(BaseChatDownloader):
         ]
     }
 
-    _MESSAGE_TYPE_REMAPPING = {}
-    for _message_group in _MESSAGE_GROUP_REMAPPINGS:
-        _value = _MESSAGE_GROUP_REMAPPINGS[_message_group]
-        _MESSAGE_TYPE_REMAPPING.update(_value)
-
-        if _message_group not in _MESSAGE_GROUPS:
-            _MESSAGE_GROUPS[_message_group] = []
-        _MESSAGE_GROUPS[_message_group] += list(_value.values())
+    _MESSAGE_TYPE_REMAPPING = {
+        key: value
+        for _remapping in _MESSAGE_GROUP_REMAPPINGS.values()
+        for key, value in _remapping.items()
+    }
+    for _message_group, _remapping in _MESSAGE_GROUP_REMAPPINGS.items():
+        _MESSAGE_GROUPS.setdefault(_message_group, []).extend(
+            _remapping.values())
+    del _message_group, _remapping
 
     _SUBSCRIBER_BADGE_INFO = {}  # local cache for subscriber badge info
-    _SUBSCRIBER_BADGE_URL = 'https://badges.twitch.tv/v1/badges/channels/{}/display'
+    _SUBSCRIBER_BADGE_URL = 'https://badges.twitch.tv/v1/badges/channels/'
 
     def _update_subscriber_badge_info(self, channel_id):
-        # print('updated sub badges')
-        url = self._SUBSCRIBER_BADGE_URL.format(channel_id)
-
         # only get if not in dict
         channel_id = int(channel_id)  # ensure integer
         if channel_id not in self._SUBSCRIBER_BADGE_INFO:
+            url = f'{self._SUBSCRIBER_BADGE_URL}{channel_id}/display'
             self._SUBSCRIBER_BADGE_INFO[channel_id] = self._session_get_json(
                 url).get('badge_sets') or {}
+            self._get_badge_info.cache_clear()
 
     @staticmethod
     def _parse_item(item, offset, channel_id=None):
         info = {}
 
-        for key in item:
-            r.remap(info, TwitchChatDownloader._COMMENT_REMAPPING,
-                    key, item[key])
+        get_remap = TwitchChatDownloader._COMMENT_REMAPPING_FLAT.get
+        for key, value in item.items():
+            remap = get_remap(key)
+            if remap is None:
+                continue
+
+            new_key, remap_function, to_unpack = remap
+            if remap_function:
+                value = remap_function(value)
+
+            if to_unpack:
+                info.update(value)
+            else:
+                info[new_key] = value
 
         if 'time_in_seconds' in info:
             info['time_in_seconds'] -= offset
             info['time_text'] = seconds_to_time(int(info['time_in_seconds']))
 
+        # The only author fields which are not part of the commenter are the
+        # colour and badges (added by _parse_message_info), so move them
+        # directly instead of scanning every key with _move_to_dict.
         badges = info.pop('author_badges', None)
-        if badges:
-            info['author']['badges'] = list(map(lambda x: TwitchChatDownloader._parse_badge_info(
-                x.get('setID'), x.get('version'), channel_id), badges))
-
-        BaseChatDownloader._move_to_dict(info, 'author')
+        colour = info.pop('author_colour', None)
+        if badges or colour is not None:
+            author = info.setdefault('author', {})
+            if badges:
+                parse_badge_info = TwitchChatDownloader._parse_badge_info
+                author['badges'] = [
+                    parse_badge_info(badge.get('setID'), badge.get('version'), channel_id)
+                    for badge in badges
+                ]
+            if colour is not None:
+                author['colour'] = colour
 
         original_message_type = info.get('message_type')
         if original_message_type:
@@ -850,20 +952,43 @@ class TwitchChatDownloader(BaseChatDownloader):
     }
 
     def _download_base_gql(self, ops):
-        return self._session_post(self._GQL_API_URL, json=ops, headers={
+        return json_loads(self._session_post(self._GQL_API_URL, data=json_dumps_bytes(ops), headers={
             'Content-Type': 'text/plain;charset=UTF-8',
             'Client-ID': self._CLIENT_ID
-        }).json()
+        }).content)
+
+    def _download_with_retries(self, download_function, query, params, *keys):
+        """Download the response to a query, retrying if it fails.
+
+        :param download_function: Function used to send the query
+        :type download_function: function
+        :param query: The query to send
+        :type query: Union[list, dict]
+        :param params: Parameters used for retrying (e.g. max_attempts)
+        :type params: dict
+        :param keys: Path of keys to the item of the response to return
+        :return: The item at the given path of the response
+        :rtype: object
+        """
+        for attempt_number in attempts(params.get('max_attempts')):
+            try:
+                response = download_function(query)
+                for key in keys:
+                    response = response[key]
+                return response
+            except (JSONDecodeError, RequestException) as e:
+                self.retry(attempt_number, error=e, **params)
 
     def _download_gql(self, ops):
-        for op in ops:
-            op['extensions'] = {
+        return self._download_base_gql([{
+            **op,
+            'extensions': {
                 'persistedQuery': {
                     'version': 1,
                     'sha256Hash': self._OPERATION_HASHES[op['operationName']],
                 }
             }
-        return self._download_base_gql(ops)
+        } for op in ops])
 
     _GAME_REMAPPING = {
         'id': 'id',
@@ -905,10 +1030,11 @@ class TwitchChatDownloader(BaseChatDownloader):
         # LAST_MONTH
         # ALL_TIME
 
-        # offset= 20# , offset = 0
+        remap_dict = r.remap_dict
+        remapping = TwitchChatDownloader._CLIP_REMAPPING
 
         remaining_count = limit
-        offset = 0
+        cursor = None
         while True:
             num_to_get = max(min(remaining_count, 100), 0)  # in this call
             if num_to_get <= 0:
@@ -917,7 +1043,6 @@ class TwitchChatDownloader(BaseChatDownloader):
             query = [{
                 'operationName': 'ClipsCards__User',
                 'variables': {
-                    'cursor': base64.b64encode(str(offset).encode()).decode(),
                     'login': username,
                     'limit': num_to_get,
                     'criteria': {
@@ -925,6 +1050,9 @@ class TwitchChatDownloader(BaseChatDownloader):
                     }
                 }
             }]
+            if cursor:
+                query[0]['variables']['cursor'] = cursor
+
             info = self._download_gql(query)
             if not info:
                 break
@@ -932,15 +1060,22 @@ class TwitchChatDownloader(BaseChatDownloader):
             clips = info[0]['data']['user']['clips']
 
             edges = clips['edges']
+            if not edges:
+                break
+
             remaining_count -= len(edges)
 
             for edge in edges:
                 node = edge['node'] or {}
-                yield r.remap_dict(node, TwitchChatDownloader._CLIP_REMAPPING)
+                yield remap_dict(node, remapping)
 
             if not clips['pageInfo']['hasNextPage']:
                 break
 
+            cursor = edges[-1].get('cursor')
+            if not cursor:
+                break
+
     _VIDEO_REMAPPING = {
         'id': r('id', str_or_none),
         'animatedPreviewURL': 'animated_preview_url',
@@ -979,6 +1114,9 @@ class TwitchChatDownloader(BaseChatDownloader):
         if limit is None:
             limit = float('inf')
 
+        remap_dict = r.remap_dict
+        remapping = TwitchChatDownloader._VIDEO_REMAPPING
+
         remaining_count = limit
         cursor = None
 
@@ -1009,18 +1147,24 @@ class TwitchChatDownloader(BaseChatDownloader):
                 break
 
             edges = videos['edges']
+            if not edges:
+                break
+
             remaining_count -= len(edges)
 
             for edge in edges:
-                cursor = edge.get('cursor')
                 node = edge.get('node')
                 if not node:
                     continue
-                yield r.remap_dict(node, TwitchChatDownloader._VIDEO_REMAPPING)
+                yield remap_dict(node, remapping)
 
             if not videos['pageInfo']['hasNextPage']:
                 break
 
+            cursor = edges[-1].get('cursor')
+            if not cursor:
+                break
+
     def get_featured_videos(self, username):
         query = [{
             'operationName': 'ChannelVideoShelvesQuery',
@@ -1051,6 +1195,9 @@ class TwitchChatDownloader(BaseChatDownloader):
     }
 
     def get_top_livestreams(self, limit=30):
+        remap_dict = r.remap_dict
+        remapping = TwitchChatDownloader._LIVESTREAM_REMAPPING
+
         remaining_count = limit
 
         cursor = ''
@@ -1074,13 +1221,18 @@ class TwitchChatDownloader(BaseChatDownloader):
                 }
             }]
             edges = self._download_gql(query)[0]['data']['streams']['edges']
+            if not edges:
+                break
 
-            cursor = edges[-1]['cursor']
-            remaining_count -= num_to_get
+            remaining_count -= len(edges)
 
             for edge in edges:
                 node = edge['node'] or {}
-                yield r.remap_dict(node, TwitchChatDownloader._LIVESTREAM_REMAPPING)
+                yield remap_dict(node, remapping)
+
+            cursor = edges[-1].get('cursor')
+            if not cursor:
+                break
 
     _TWITCH_HOME = 'https://www.twitch.tv'
     _TWITCH_VIDEOS = 'https://www.twitch.tv/videos'
@@ -1130,18 +1282,22 @@ class TwitchChatDownloader(BaseChatDownloader):
             end_time = ensure_seconds(e_time, max_duration)
             content_offset_seconds = (start_time or 0) + offset
 
-        max_attempts = params.get('max_attempts')
-
         messages_groups_to_add = params.get('message_groups') or []
         messages_types_to_add = params.get('message_types') or []
 
+        # None if all message types should be added
+        valid_message_types = self._get_valid_message_types(
+            self._MESSAGE_GROUPS, messages_groups_to_add, messages_types_to_add)
+
+        # Only look for unknown keys if they would actually be reported
+        check_keys = debug_enabled()
+
         # api_url = self._API_TEMPLATE.format(vod_id, self._CLIENT_ID)
 
         message_count = 0
         # do not need inactivity timeout (not live)
 
-        cursor = ''
-        while True:
+        def get_page(cursor):
             variables = {
                 'videoID': vod_id,
             }
@@ -1156,24 +1312,23 @@ class TwitchChatDownloader(BaseChatDownloader):
                 'variables': variables
             }]
 
-            for attempt_number in attempts(max_attempts):
-                try:
-                    info = self._download_gql(query)[0]['data']['video']
-                    break
-                except (JSONDecodeError, RequestException) as e:
-                    self.retry(attempt_number, error=e, **params)
+            return self._download_with_retries(
+                self._download_gql, query, params, 0, 'data', 'video')
+
+        cursor = ''
+        while True:
+            info = get_page(cursor)
 
             comments = info.get('comments')
             if not comments:
                 break
 
+            edges = comments.get('edges') or []
+
             # Used for custom badge retrieval
             creator_channel_id = multi_get(info, 'creator', 'channel', 'id')
 
-            edges = comments.get('edges') or []
-
             for edge in edges:
-                cursor = edge.get('cursor')
                 node = edge.get('node')
                 if not node:
                     continue
@@ -1181,16 +1336,17 @@ class TwitchChatDownloader(BaseChatDownloader):
                 data = self._parse_item(node, offset, creator_channel_id)
 
                 # test for missing keys
-                missing_keys = data.keys() - TwitchChatDownloader._KNOWN_COMMENT_KEYS
-
-                if missing_keys:
-                    debug_log(
-                        f'Missing keys found: {missing_keys}',
-                        f'Original data: {node}',
-                        f'Parsed data: {data}',
-                        node.keys(),
-                        TwitchChatDownloader._KNOWN_COMMENT_KEYS
-                    )
+                if check_keys:
+                    missing_keys = data.keys() - TwitchChatDownloader._KNOWN_COMMENT_KEYS
+
+                    if missing_keys:
+                        debug_log(
+                            f'Missing keys found: {missing_keys}',
+                            f'Original data: {node}',
+                            f'Parsed data: {data}',
+                            node.keys(),
+                            TwitchChatDownloader._KNOWN_COMMENT_KEYS
+                        )
 
                 time_in_seconds = data.get('time_in_seconds', 0)
 
@@ -1202,14 +1358,7 @@ class TwitchChatDownloader(BaseChatDownloader):
                 elif after_end:  # after end
                     return  # while actually searching, if time is invalid
 
-                to_add = self._must_add_item(
-                    data,
-                    self._MESSAGE_GROUPS,
-                    messages_groups_to_add,
-                    messages_types_to_add
-                )
-
-                if not to_add:
+                if valid_message_types is not None and data.get('message_type') not in valid_message_types:
                     continue
 
                 message_count += 1
@@ -1217,15 +1366,17 @@ class TwitchChatDownloader(BaseChatDownloader):
 
             log('debug', f'Total number of messages: {message_count}')
 
-            if not comments['pageInfo']['hasNextPage']:
+            if not edges or not comments['pageInfo']['hasNextPage']:
+                break
+
+            cursor = edges[-1].get('cursor')
+            if not cursor:  # would otherwise request the first page again
                 break
 
     def _get_chat_by_vod_id(self, match, params):
         return self.get_chat_by_vod_id(match.group('id'), params)
 
     def get_chat_by_vod_id(self, vod_id, params):
-        max_attempts = params.get('max_attempts')
-
         query = [{
             'operationName': 'VideoMetadata',
             'variables': {
@@ -1234,12 +1385,8 @@ class TwitchChatDownloader(BaseChatDownloader):
             }
         }]
 
-        for attempt_number in attempts(max_attempts):
-            try:
-                video = self._download_gql(query)[0]['data']['video']
-                break
-            except (JSONDecodeError, RequestException) as e:
-                self.retry(attempt_number, error=e, **params)
+        video = self._download_with_retries(
+            self._download_gql, query, params, 0, 'data', 'video')
 
         if not video:
             raise VideoUnavailable(
@@ -1250,7 +1397,7 @@ class TwitchChatDownloader(BaseChatDownloader):
         # print('duration', duration)
 
         channel_id = multi_get(video, 'owner', 'id')
-        self._update_subscriber_badge_info(channel_id)
+        self._update_badge_info(channel_id)
 
         return Chat(
             self._get_chat_messages_by_vod_id(
@@ -1267,18 +1414,12 @@ class TwitchChatDownloader(BaseChatDownloader):
 
     def get_chat_by_clip_id(self, clip_id, params):
 
-        max_attempts = params.get('max_attempts')
-
         query = {
             'query': '{ clip(slug: "%s") { broadcaster { id } video { id createdAt } createdAt durationSeconds videoOffsetSeconds title url slug } }' % clip_id,
         }
 
-        for attempt_number in attempts(max_attempts):
-            try:
-                clip = self._download_base_gql(query)['data']['clip']
-                break
-            except (JSONDecodeError, RequestException) as e:
-                self.retry(attempt_number, error=e, **params)
+        clip = self._download_with_retries(
+            self._download_base_gql, query, params, 'data', 'clip')
 
         vod_id = multi_get(clip, 'video', 'id')
 
@@ -1292,7 +1433,7 @@ class TwitchChatDownloader(BaseChatDownloader):
         title = f"{clip.get('title')} ({clip_id})"
 
         channel_id = multi_get(clip, 'broadcaster', 'id')
-        self._update_subscriber_badge_info(channel_id)
+        self._update_badge_info(channel_id)
 
         return Chat(
             self._get_chat_messages_by_vod_id(
@@ -1304,21 +1445,71 @@ class TwitchChatDownloader(BaseChatDownloader):
             id=clip_id
         )
 
-    _MESSAGE_REGEX = re.compile(
-        r'^@(.+?(?=\s+:)).*tmi\.twitch\.tv\s+(\S+)(?:[^#\r\n]+#)?\s(?:\S+)?(?:\s:([^\r\n]*))?', re.MULTILINE)
-    # Groups:
-    # 1. Tag info
-    # 2. Action type
-    # 3. Message
+    @staticmethod
+    def _parse_irc_line(line):
+        """Split a raw IRC line of the form
+        `@<tags> :<prefix> <command> [<params>] [:<message>]`
+        into its parts. This is done manually (instead of with a regular
+        expression) since it is called for every message received.
+
+        :param line: A single IRC line, without the trailing CRLF
+        :type line: str
+        :return: Tuple of the form (tags, command, message), or None if the
+            line does not contain any tags (e.g. PING or numeric replies)
+        :rtype: tuple
+        """
+        if not line.startswith('@'):
+            return None
+
+        tags_end = line.find(' ')
+        if tags_end == -1:
+            return None
+
+        tags = line[1:tags_end]
+        rest = line[tags_end + 1:].lstrip(' ')
+
+        if rest.startswith(':'):  # Skip prefix (e.g. :tmi.twitch.tv)
+            rest = rest.partition(' ')[2]
+
+        command, _, rest = rest.partition(' ')
+
+        if rest.startswith(':'):
+            message = rest[1:]
+        else:
+            message = rest.partition(' :')[2]
+
+        return tags, command, message or None
 
     # A full list can be found here: https://badges.twitch.tv/v1/badges/global/display
 
-    _BADGE_KEYS = ('title', 'description', 'image_url_1x',
-                   'image_url_2x', 'image_url_4x', 'click_action', 'click_url')
-    _BADGE_ID_REGEX = r'v1/([^/]+)/'
+    _BADGE_KEYS = ('title', 'description', 'click_action', 'click_url')
+    _BADGE_IMAGE_KEYS = (('image_url_1x', 18), ('image_url_2x', 36), ('image_url_4x', 72))
+    _BADGE_ID_REGEX = re.compile(r'v1/([^/]+)/')
 
     @staticmethod
     def _parse_badge_info(name, version, channel_id=None):
+        # The same few badges are attached to most messages, so the parsed
+        # badge is cached. Copies are returned so that the cached badge
+        # cannot be modified through a returned item.
+        badge = TwitchChatDownloader._get_badge_info(name, version, channel_id)
+        icons = badge.get('icons')
+        if icons is None:
+            return dict(badge)
+        return {**badge, 'icons': [dict(icon) for icon in icons]}
+
+    @staticmethod
+    def _get_badge_version(badge_sets, name, version):
+        # Equivalent to multi_get(badge_sets, name, 'versions', version),
+        # without the generic type checks
+        badge_set = badge_sets.get(name) if badge_sets else None
+        if not badge_set:
+            return None
+        versions = badge_set.get('versions')
+        return versions.get(version) if versions else None
+
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def _get_badge_info(name, version, channel_id=None):
         new_badge = {
             'name': replace_with_underscores(name),
             'version': int_or_none(version, version)
@@ -1328,49 +1519,52 @@ class TwitchChatDownloader(BaseChatDownloader):
 
         new_badge_info = None
         if channel_id is not None:
-            new_badge_info = multi_get(TwitchChatDownloader._SUBSCRIBER_BADGE_INFO, int(
-                channel_id), name, 'versions', version)
+            new_badge_info = TwitchChatDownloader._get_badge_version(
+                TwitchChatDownloader._SUBSCRIBER_BADGE_INFO.get(int(channel_id)), name, version)
 
         if not new_badge_info:
-            new_badge_info = multi_get(
-                TwitchChatDownloader._BADGE_INFO, name, 'versions', version)
+            new_badge_info = TwitchChatDownloader._get_badge_version(
+                TwitchChatDownloader._BADGE_INFO, name, version)
 
         if new_badge_info:
             for key in TwitchChatDownloader._BADGE_KEYS:
                 new_badge[key] = new_badge_info.get(key)
 
-            image_urls = [
-                (new_badge.pop(f'image_url_{i}x', ''), i * 18) for i in (1, 2, 4)]
-            if image_urls:
-                new_badge['icons'] = []
-
-            for image_url, size in image_urls:
-                new_badge['icons'].append(Image(image_url, size, size).json())
+            new_badge['icons'] = [
+                Image(new_badge_info.get(key) or '', size, size).json()
+                for key, size in TwitchChatDownloader._BADGE_IMAGE_KEYS
+            ]
 
-            if image_urls:
-                badge_id = re.search(
-                    TwitchChatDownloader._BADGE_ID_REGEX, image_urls[0][0] or '')
-                if badge_id:
-                    new_badge['id'] = badge_id.group(1)
+            badge_id = TwitchChatDownloader._BADGE_ID_REGEX.search(
+                new_badge_info.get('image_url_1x') or '')
+            if badge_id:
+                new_badge['id'] = badge_id.group(1)
 
         return new_badge
 
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def _split_irc_badges(badges):
+        # e.g. 'subscriber/6,premium/1' -> (('subscriber', '6'), ('premium', '1'))
+        split_badges = []
+        for badge in badges.split(','):
+            name, has_version, version = badge.partition('/')
+            # If there's no /, we assign a value of None (null).
+            split_badges.append((name, version if has_version else None))
+        return tuple(split_badges)
+
     @staticmethod
     def _parse_irc_badges(badges, channel_id):
-        info = []
         if not badges:
-            return info
+            return []
 
-        for badge in badges.split(','):
-            split = badge.split('/', 1)
-            key_length = len(split)
-            if key_length == 1:
-                # If there's no /, we assign a value of None (null).
-                split.append(None)
-
-            info.append(TwitchChatDownloader._parse_badge_info(
-                split[0], split[1], channel_id))
-        return info
+        # Badge strings repeat across messages, so both the splitting and
+        # the parsing of each individual badge are cached
+        parse_badge_info = TwitchChatDownloader._parse_badge_info
+        return [
+            parse_badge_info(name, version, channel_id)
+            for name, version in TwitchChatDownloader._split_irc_badges(badges)
+        ]
 
     @staticmethod
     def _set_message_type(info, original_message_type):
@@ -1389,9 +1583,8 @@ class TwitchChatDownloader(BaseChatDownloader):
     def _add_text_for_emotes(message, emote_list):
         for emote in emote_list:
             try:
-                first_location = list(
-                    map(lambda x: int(x), emote['locations'][0].split('-')))
-                emote['name'] = message[first_location[0]:first_location[1] + 1]
+                begin, _, end = emote['locations'][0].partition('-')
+                emote['name'] = message[int(begin):int(end) + 1]
             except Exception:
                 debug_log(
                     f'Invalid emote: {emote}',
@@ -1400,32 +1593,34 @@ class TwitchChatDownloader(BaseChatDownloader):
                 continue
 
     @staticmethod
-    def _parse_irc_item(match):
+    def _parse_irc_item(tags, original_action_type, message):
         info = {}
 
-        split_info = match.group(1).split(';')
-
-        for item in split_info:
-            keys = item.split('=', 1)
-            key_length = len(keys)
-            if key_length == 1:
+        # Bound once, since these are used for every tag
+        get_remap = TwitchChatDownloader._IRC_REMAPPING_FLAT.get
+        update_info = info.update
+        for item in tags.split(';'):
+            key, has_value, value = item.partition('=')
+            if not has_value:
                 # If there's no equals, we assign the tag a value of true.
-                keys.append(True)
-            elif key_length == 2:
-                pass
-            else:  # TODO never reaches this
-                debug_log(
-                    f'Invalid item found: {item}.',
-                    f'All items: {split_info}.',
-                )
+                value = True
+
+            remap = get_remap(key)
+            if remap is None:  # Keep unknown keys
+                info[key.replace('-', '_')] = value
                 continue
 
-            r.remap(info, TwitchChatDownloader._IRC_REMAPPING,
-                    keys[0], keys[1], keep_unknown_keys=True, replace_char_with_underscores='-')
+            new_key, remap_function, to_unpack = remap
+            if remap_function:
+                value = remap_function(value)
 
-        message_match = match.group(3)
-        if message_match:
-            info['message'] = remove_prefixes(message_match, '\u0001ACTION ')
+            if to_unpack:
+                update_info(value)
+            else:
+                info[new_key] = value
+
+        if message:
+            info['message'] = remove_prefixes(message, '\u0001ACTION ')
 
             emotes = info.pop('emotes', None)
             if emotes:
@@ -1433,33 +1628,41 @@ class TwitchChatDownloader(BaseChatDownloader):
                     info['message'], emotes)
                 info['emotes'] = emotes
 
-        author_badge_metadata = info.pop('author_badge_metadata', [])
         author_badges = info.pop('author_badges', [])
 
         info['author_badges'] = TwitchChatDownloader._parse_irc_badges(
             author_badges, info.get('channel_id'))
 
-        badge_metadata = TwitchChatDownloader._parse_irc_badges(
-            author_badge_metadata, info.get('channel_id'))
+        # The badge metadata (e.g. subscriber/8) is only used to get the
+        # exact number of months for the subscriber badge, so it does not
+        # need to be fully parsed.
+        author_badge_metadata = info.pop('author_badge_metadata', None)
+        if author_badge_metadata:
+            for badge in info['author_badges']:
+                if badge['name'] != 'subscriber':
+                    continue
 
-        subscriber_badge = next(
-            (x for x in info['author_badges'] if x.get('name') == 'subscriber'), None)
-        subscriber_badge_metadata = next(
-            (x for x in badge_metadata if x.get('name') == 'subscriber'), None)
-        if subscriber_badge and subscriber_badge_metadata:
-            subscriber_badge['months'] = int_or_none(
-                subscriber_badge_metadata['version'], 0)
+                for name, version in TwitchChatDownloader._split_irc_badges(author_badge_metadata):
+                    if name == 'subscriber':
+                        badge['months'] = int_or_none(version, 0)
+                        break
+                break
 
         author_display_name = info.get('author_display_name')
         if author_display_name:
-            info['author_name'] = author_display_name.lower()
-
-        in_reply_to = BaseChatDownloader._move_to_dict(info, 'in_reply_to')
+            # Many display names are already lowercase, in which case
+            # islower (which does not create a new string) is sufficient
+            if author_display_name.islower():
+                info['author_name'] = author_display_name
+            else:
+                info['author_name'] = author_display_name.lower()
 
-        BaseChatDownloader._move_to_dict(in_reply_to, 'author')
-        BaseChatDownloader._move_to_dict(info, 'author')
+        move_to_dict = BaseChatDownloader._move_to_dict
+        if not TwitchChatDownloader._IRC_REPLY_KEYS.isdisjoint(info):
+            in_reply_to = move_to_dict(info, 'in_reply_to')
+            move_to_dict(in_reply_to, 'author')
 
-        original_action_type = match.group(2)
+        move_to_dict(info, 'author')
 
         if original_action_type:
             new_action_type = TwitchChatDownloader._ACTION_TYPE_REMAPPING.get(
@@ -1471,7 +1674,7 @@ class TwitchChatDownloader(BaseChatDownloader):
                 info['action_type'] = original_action_type
                 debug_log([
                     f"Unknown action type: {info['action_type']}",
-                    match,
+                    (tags, original_action_type, message),
                     info
                 ])
 
@@ -1483,7 +1686,7 @@ class TwitchChatDownloader(BaseChatDownloader):
             info['message_type'] = info['action_type']
 
         if original_action_type == 'CLEARCHAT':
-            if message_match:  # is a ban
+            if message:  # is a ban
                 info['message_type'] = 'ban_user'
                 info['ban_type'] = 'timeout' if info.get(
                     'ban_duration') else 'permanent'
@@ -1520,6 +1723,13 @@ class TwitchChatDownloader(BaseChatDownloader):
         messages_groups_to_add = params.get('message_groups') or []
         messages_types_to_add = params.get('message_types') or []
 
+        # None if all message types should be added
+        valid_message_types = self._get_valid_message_types(
+            self._MESSAGE_GROUPS, messages_groups_to_add, messages_types_to_add)
+
+        # Only look for unknown keys if they would actually be reported
+        check_keys = debug_enabled()
+
         def create_connection():
             for attempt_number in attempts(max_attempts):
                 try:
@@ -1537,97 +1747,55 @@ class TwitchChatDownloader(BaseChatDownloader):
         # TODO make this a param
         ping_every = 60  # how often to ping the server
 
-        readbuffer = ''
-
         message_count = 0
 
+        # Bind frequently used attributes once, outside of the receive loop
+        parse_irc_line = self._parse_irc_line
+        parse_irc_item = self._parse_irc_item
+        ping_text = self._PING_TEXT
+        pong_bytes = self._PONG_BYTES
+
         try:
             while True:
 
                 try:
-                    new_info = twitch_chat_irc.recv(buffer_size)
-
-                    if not new_info:
-                        raise ConnectionError('Lost connection, reconnecting.')
-
-                    readbuffer += new_info
-
-                    if self._PING_TEXT in readbuffer:
-                        twitch_chat_irc.send_raw(self._PONG_TEXT)
-
-                    matches = list(self._MESSAGE_REGEX.finditer(readbuffer))
-                    full_readbuffer = readbuffer.endswith('\r\n')
-                    if matches:
-                        if not full_readbuffer:
-                            # sometimes a buffer does not contain a full message
-                            # last one is incomplete
-
-                            span = matches[-1].span()
-
-                            pass_on = readbuffer[span[0]:]
-
-                            # check whether message was cut off
-                            if '\r\n' in pass_on:  # last message not matched
-                                # only pass on incomplete message
-
-                                # readbuffer[span[1]:]
-                                pass_on = pass_on[span[1] - span[0]:]
-
-                            # actual message cut off (matched, but not complete)
-                            else:
-                                # remove the last match from being processed (as it is incomplete)
-                                matches.pop()
-
-                            # pass remaining information to next attempt
-                            readbuffer = pass_on
-
-                        else:
-                            # the whole readbuffer was read correctly.
-                            # reset the readbuffer
-                            readbuffer = ''
-
-                        for match in matches:
-
-                            data = self._parse_irc_item(match)
-
-                            # test for missing keys
+                    # Incomplete messages are kept by the connection and
+                    # completed by subsequent reads
+                    lines = twitch_chat_irc.recv_lines(buffer_size)
+
+                    for line in lines:
+                        parsed_line = parse_irc_line(line)
+                        if not parsed_line:
+                            # Only reply to an actual PING command, which
+                            # starts the line
+                            if line.startswith(ping_text):
+                                twitch_chat_irc.send_bytes(pong_bytes)
+                            continue
+
+                        data = parse_irc_item(*parsed_line)
+
+                        # test for missing keys
+                        if check_keys:
                             missing_keys = data.keys() - TwitchChatDownloader._KNOWN_IRC_KEYS
 
                             if missing_keys:
                                 debug_log(
                                     f'Missing keys found: {missing_keys}',
-                                    f'Original data: {match.groups()}',
+                                    f'Original data: {line}',
                                     f'Parsed data: {data}'
                                 )
-                            # check whether to skip this message or not, based on its type
+                        # check whether to skip this message or not, based on its type
 
-                            to_add = self._must_add_item(
-                                data,
-                                self._MESSAGE_GROUPS,
-                                messages_groups_to_add,
-                                messages_types_to_add
-                            )
-
-                            if not to_add:
-                                continue
+                        if valid_message_types is not None and data.get('message_type') not in valid_message_types:
+                            continue
 
-                            message_count += 1
-                            yield data
+                        message_count += 1
+                        yield data
 
+                    if lines:
                         log('debug',
                             f'Total number of messages: {message_count}')
 
-                    elif full_readbuffer:
-                        # No matches, but data has been read successfully.
-                        # This means that we can safely reset the readbuffer.
-                        # This is used to periodically reset the readbuffer,
-                        # to avoid a massive buffer from forming.
-
-                        # never pause
-                        log('debug',
-                            f'No matches found in "\n{readbuffer.strip()}\n"')
-                        readbuffer = ''
-
                     current_time = time.time()
 
                     time_since_last_ping = current_time - last_ping_time
@@ -1654,19 +1822,13 @@ class TwitchChatDownloader(BaseChatDownloader):
 
     def get_chat_by_stream_id(self, stream_id, params):
 
-        max_attempts = params.get('max_attempts')
-
         query = [{
             'operationName': 'StreamMetadata',
             'variables': {'channelLogin': stream_id.lower()}
         }]
 
-        for attempt_number in attempts(max_attempts):
-            try:
-                stream_info = self._download_gql(query)[0]['data']['user']
-                break
-            except (JSONDecodeError, RequestException) as e:
-                self.retry(attempt_number, error=e, **params)
+        stream_info = self._download_with_retries(
+            self._download_gql, query, params, 0, 'data', 'user')
 
         if not stream_info:
             raise UserNotFound(f'Unable to find user: "{stream_id}"')
@@ -1676,7 +1838,7 @@ class TwitchChatDownloader(BaseChatDownloader):
         title = multi_get(stream_info, 'lastBroadcast',
                           'title') if is_live else stream_id
 
-        self._update_subscriber_badge_info(channel_id)
+        self._update_badge_info(channel_id)
 
         return Chat(
             self._get_chat_messages_by_stream_id(
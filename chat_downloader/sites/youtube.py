@@ -1710,8 +1710,6 @@ class YouTubeChatDownloader(BaseChatDownloader):
 
         # force_no_timeout = params.get('force_no_timeout')
 
-        max_attempts = params.get('max_attempts')
-
         messages_groups_to_add = params.get('message_groups') or []
         messages_types_to_add = params.get('message_types') or []
 
@@ -1724,6 +1722,10 @@ class YouTubeChatDownloader(BaseChatDownloader):
         self.check_for_invalid_types(
             messages_types_to_add, self._MESSAGE_TYPES)
 
+        # None if all message types should be added
+        valid_message_types = self._get_valid_message_types(
+            self._MESSAGE_GROUPS, messages_groups_to_add, messages_types_to_add)
+
         # Generate base headers and update session headers
         self.update_session_headers(self._generate_headers(ytcfg))
 
@@ -1932,14 +1934,7 @@ class YouTubeChatDownloader(BaseChatDownloader):
 
                     # check whether to skip this message or not, based on its type
 
-                    to_add = self._must_add_item(
-                        data,
-                        self._MESSAGE_GROUPS,
-                        messages_groups_to_add,
-                        messages_types_to_add
-                    )
-
-                    if not to_add:
+                    if valid_message_types is not None and data.get('message_type') not in valid_message_types:
                         continue
 
                     # if from a replay, check whether to skip this message or not, based on its time
@@ -171,6 +171,51 @@ def try_parse_json(text, default=None):
         return default
 
 
+try:
+    import orjson
+except ImportError:
+    HAS_ORJSON = False
+else:
+    HAS_ORJSON = True
+
+
+def json_dumps_bytes(obj):
+    """Serialise an object to UTF-8 encoded JSON. If available, `orjson`
+    is used, which is faster and produces bytes directly.
+
+    :param obj: The object to serialise
+    :type obj: object
+    :return: The UTF-8 encoded JSON
+    :rtype: bytes
+    """
+    if HAS_ORJSON:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode('utf-8')
+
+
+def json_loads(data):
+    """Deserialise JSON from a str or bytes object. If available, `orjson`
+    is used, which is faster and can parse bytes without decoding them first.
+    Documents which `orjson` rejects (e.g. bytes starting with a UTF-8 BOM)
+    are passed on to `json.loads`.
+
+    Unlike `json.loads`, `orjson` returns integers which do not fit in 64
+    bits as floats, so very large integer values may lose precision.
+
+    :param data: The JSON document
+    :type data: Union[str, bytes]
+    :raises JSONDecodeError: If the document is not valid JSON
+    :return: The deserialised object
+    :rtype: object
+    """
+    if HAS_ORJSON:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
 def wrap_as_list(item):
     """Wraps an item in a list, if it is not already iterable
 
@@ -1,41 +1,41 @@
 import argparse
 import os
+import re
+from array import array
+from bisect import bisect_left
 from chat_downloader import ChatDownloader
-from typing import List
+from functools import lru_cache
+from itertools import chain, islice
+from typing import Iterable, Iterator, List, Pattern, Tuple
 
 class ChatMessage:
-    TimestampSeconds: float
+    """The text of a chat message. Timestamps are kept separately, in an array parallel to the list of messages."""
+    __slots__ = ('Author', 'MessageText', 'Color')
     Author: str
     MessageText: str
     Color: str
-    def __init__(self, timestamp_seconds: float, author:str, message_text: str, color: str) -> None:
-        self.TimestampSeconds = timestamp_seconds
+    def __init__(self, author:str, message_text: str, color: str) -> None:
         self.Author = author
         self.MessageText = message_text
         self.Color = color
 
-class SrtLine:
-    Index: int
-    StartTimeSeconds: float
-    EndTimeSeconds: float
-    Author: str
-    MessageText: str
-    Color: str
-    def __init__(self, index: int, start_time_seconds: float, end_time_seconds: float, author: str, message_text: str, color: str) -> None:
-        self.Index = index
-        self.StartTimeSeconds = start_time_seconds
-        self.EndTimeSeconds = end_time_seconds
-        self.Author = author
-        self.MessageText = message_text
-        self.Color = color
-    def __seconds_to_timestamp(self, seconds: float):
-        int_seconds = int(seconds)
-        h, remainder = divmod(abs(int_seconds), 3600)
-        m, s = divmod(remainder, 60)
-        milliseconds = round(1000 * (float(seconds) - int_seconds))
-        return f"{'-' if seconds < 0 else ''}{h:02}:{m:02}:{s:02},{milliseconds:03}"
-    def to_string(self) -> str:
-        return f'{self.Index}\n{self.__seconds_to_timestamp(self.StartTimeSeconds)} --> {self.__seconds_to_timestamp(self.EndTimeSeconds)}\n<font color="#{self.Color}">{self.Author}</font>: {self.MessageText}\n\n'
+def format_timestamp(milliseconds: int, milliseconds_per_unit: int, template: str) -> str:
+    """Formats a timestamp using a template for the hours, minutes, seconds and fraction of a second, where the fraction is counted in units of milliseconds_per_unit. This is shared by the SRT and ASS formats, which differ only in precision and punctuation."""
+    if milliseconds < 0:
+        return '-' + format_timestamp(-milliseconds, milliseconds_per_unit, template)
+    # Round to the nearest unit before splitting, so that the fraction carries into the seconds rather than overflowing.
+    units = (milliseconds + milliseconds_per_unit // 2) // milliseconds_per_unit
+    s, fraction = divmod(units, 1000 // milliseconds_per_unit)
+    m, s = divmod(s, 60)
+    h, m = divmod(m, 60)
+    # %-formatting is noticeably cheaper than an f-string with format specs, and this runs twice per line.
+    return template % (h, m, s, fraction)
+
+srtTimestampTemplate = '%02d:%02d:%02d,%03d'
+srtLineTemplate = '%d\n%s --> %s\n<font color="#%s">%s</font>: %s\n\n'
+
+def format_srt_line(index: int, start_time_milliseconds: int, end_time_milliseconds: int, author: str, message_text: str, color: str) -> str:
+    return srtLineTemplate % (index, format_timestamp(start_time_milliseconds, 1, srtTimestampTemplate), format_timestamp(end_time_milliseconds, 1, srtTimestampTemplate), color, author, message_text)
 
 assHeader = """[Script Info]
 ScriptType: v4.00+
@@ -52,57 +52,60 @@ Style: Default,Myriad Web Pro Condensed,26,&H00ffffff,&H0000ffff,&H0025253a,&H96
 Format: Layer, Start, End, Style, Actor, MarginL, MarginR, MarginV, Effect, Text
 """
 
-class AssLine:
-    StartTimeSeconds: float
-    EndTimeSeconds: float
-    Author: str
-    MessageText: str
-    Color: str
-    def __init__(self, start_time_seconds: float, end_time_seconds: float, author: str, message_text: str, color: str) -> None:
-        self.StartTimeSeconds = start_time_seconds
-        self.EndTimeSeconds = end_time_seconds
-        self.Author = author
-        self.MessageText = message_text
-        self.Color = color
-    def __seconds_to_timestamp(self, seconds: float):
-        int_seconds = int(seconds)
-        h, remainder = divmod(abs(int_seconds), 3600)
-        m, s = divmod(remainder, 60)
-        hundredths = round(100 * (float(seconds) - int_seconds))
-        return f"{'-' if seconds < 0 else ''}{h:01}:{m:02}:{s:02}.{hundredths:02}"
-    def to_string(self) -> str:
-        fadeMilliseconds = round(1000 * (self.EndTimeSeconds - self.StartTimeSeconds) / 20)
-        return f'Dialogue: 0,{self.__seconds_to_timestamp(self.StartTimeSeconds)},{self.__seconds_to_timestamp(self.EndTimeSeconds)},,,0000,0000,0000,,{{\\move(320,480,320,360)}}{{\\fad({fadeMilliseconds},{fadeMilliseconds})}}{{\\1c&H{self.Color}&}}{self.Author}: {{\\1c&HFFFFFF&}}{self.MessageText}\n'
-
-def even_spaced_timestamp_filter(chat_messages: List[ChatMessage], smoothing_interval_seconds: float):
-    """Smooths out chat message timestamps within regularly-spaced intervals, so that timestamps are more evenly-spaced. This helps readability when bursts of several messages occur at nearly the same time."""
-    if len(chat_messages) == 0:
-        return
+assTimestampTemplate = '%01d:%02d:%02d.%02d'
+assLineTemplate = 'Dialogue: 0,%s,%s,,,0000,0000,0000,,{\\move(320,480,320,360)}{\\fad(%d,%d)}{\\1c&H%s&}%s: {\\1c&HFFFFFF&}%s\n'
+
+def format_ass_line(start_time_milliseconds: int, end_time_milliseconds: int, author: str, message_text: str, color: str) -> str:
+    fadeMilliseconds = (end_time_milliseconds - start_time_milliseconds + 10) // 20
+    return assLineTemplate % (format_timestamp(start_time_milliseconds, 10, assTimestampTemplate), format_timestamp(end_time_milliseconds, 10, assTimestampTemplate), fadeMilliseconds, fadeMilliseconds, color, author, message_text)
+
+def even_spaced_timestamp_filter(timestamps_seconds: 'array[float]', smoothing_interval_seconds: float) -> 'array[int]':
+    """Smooths out chat message timestamps within regularly-spaced intervals, so that timestamps are more evenly-spaced. This helps readability when bursts of several messages occur at nearly the same time.
+    Messages are assigned to intervals by their exact timestamps in seconds, and only the smoothed timestamps are rounded, to whole milliseconds."""
+    if len(timestamps_seconds) == 0:
+        return array('q')
     if smoothing_interval_seconds <= 0:
         raise ValueError(f'smoothingIntervalSeconds must be positive, but was {smoothing_interval_seconds}')
+    intervalMilliseconds = max(round(1000 * smoothing_interval_seconds), 1)
+    # Messages which are not smoothed keep their own timestamps, rounded to whole milliseconds.
+    timestamps = array('q', (round(1000 * timestamp) for timestamp in timestamps_seconds))
+    messageCount = len(timestamps_seconds)
+    lastTimestamp = timestamps_seconds[-1]
     minIndex = 0
-    maxIndex = -1
-    minTimestamp = 0
-    maxTimestamp = smoothing_interval_seconds
-    lastTimestamp = chat_messages[-1].TimestampSeconds
-    while minTimestamp < lastTimestamp:
-        while maxIndex + 1 < len(chat_messages) and chat_messages[maxIndex + 1].TimestampSeconds < maxTimestamp:
-            maxIndex += 1
-        commentsInInterval = maxIndex - minIndex + 1
-        if commentsInInterval > 0:
-            for i in range(0, commentsInInterval):
-                chat_messages[minIndex + i].TimestampSeconds = minTimestamp + (2 * i + 1) * smoothing_interval_seconds / (2 * commentsInInterval)
-        minIndex = maxIndex + 1
-        minTimestamp += smoothing_interval_seconds
-        maxTimestamp += smoothing_interval_seconds
-
-def parse_chat_messages(chats) -> List[ChatMessage]:
+    while minIndex < messageCount:
+        # Jump straight to the interval containing the next message, rather than stepping through empty intervals.
+        intervalIndex = max(int(timestamps_seconds[minIndex] // smoothing_interval_seconds), 0)
+        minTimestamp = intervalIndex * smoothing_interval_seconds
+        if minTimestamp >= lastTimestamp:
+            break
+        maxIndex = bisect_left(timestamps_seconds, minTimestamp + smoothing_interval_seconds, minIndex + 1)
+        # Place the messages at odd multiples of half a step, so they are evenly spaced with half a step of padding at either end.
+        # Each position is rounded to the nearest millisecond.
+        minMilliseconds = intervalIndex * intervalMilliseconds
+        doubleCount = 2 * (maxIndex - minIndex)
+        oddMultiple = 1
+        for i in range(minIndex, maxIndex):
+            timestamps[i] = minMilliseconds + (oddMultiple * intervalMilliseconds + doubleCount // 2) // doubleCount
+            oddMultiple += 2
+        minIndex = maxIndex
+    return timestamps
+
+@lru_cache(maxsize=1024)
+def compile_shortcut_pattern(shortcuts: Tuple[str, ...]) -> Pattern:
+    """Compiles a pattern which matches any of the given emote shortcuts, trying longer shortcuts first. The same emotes are used in many messages, so patterns are cached."""
+    return re.compile('|'.join(map(re.escape, sorted(shortcuts, key=len, reverse=True))))
+
+def parse_chat_messages(chats) -> Tuple[List[ChatMessage], 'array[float]']:
+    """Returns the parsed chat messages, along with an array of their timestamps in seconds."""
     chatMessages: List[ChatMessage] = []
+    timestamps = array('d')
     for chat in chats:
         messageText: str = chat['message']
         # Replace shorthand emotes, like :partying_face:, with UTF, like 🥳.
         emotes = chat.get('emotes')
-        if emotes:
+        # Shortcuts are always colon-delimited, so a message without a colon has nothing to replace.
+        if emotes and ':' in messageText:
+            replacements = {}
             for emote in emotes:
                 utfId = emote.get('id')
                 shortcuts = emote.get('shortcuts')
@@ -110,69 +113,81 @@ def parse_chat_messages(chats) -> List[ChatMessage]:
                 isNotCustomEmoji = emote.get('is_custom_emoji') == False
                 if utfId and shortcuts and isNotCustomEmoji:
                     for shortcut in shortcuts:
-                        messageText = messageText.replace(shortcut, utfId)
+                        replacements.setdefault(shortcut, utfId)
+            if replacements:
+                pattern = compile_shortcut_pattern(tuple(replacements))
+                messageText = pattern.sub(lambda match: replacements[match.group(0)], messageText)
         author = chat['author']
         color: str = author.get('colour')
         if not color:
             color = '00FF00'
         else:
             color = color.strip('#')
+        timestamps.append(chat['time_in_seconds'])
         chatMessages.append(ChatMessage(
-            timestamp_seconds=chat['time_in_seconds'],
             author=author['name'],
             message_text=messageText,
             color=color))
-    return chatMessages
+    return chatMessages, timestamps
 
-def parse_srt_lines(chat_messages: List[ChatMessage], max_seconds_onscreen: float = 5) -> List[SrtLine]:
+def parse_srt_lines(chat_messages: List[ChatMessage], timestamps: 'array[int]', max_seconds_onscreen: float = 5) -> Iterator[str]:
+    """Yields formatted subtitle lines one at a time, so that they can be written out without holding every line in memory."""
     if max_seconds_onscreen <= 0:
         raise ValueError(f'max_seconds_onscreen must be positive, but was {max_seconds_onscreen}')
-    srtLines: List[SrtLine] = []
-    for index, chatMessage in enumerate(chat_messages):
-        nextTimestampSeconds = chat_messages[index + 1].TimestampSeconds if index + 1 < len(chat_messages) else float("inf")
-        srtLines.append(SrtLine(
+    maxMillisecondsOnscreen = round(1000 * max_seconds_onscreen)
+    # Pair each timestamp with the next one, treating the last message as if it were followed by nothing.
+    nextTimestamps = chain(islice(timestamps, 1, None), (float("inf"),))
+    for index, (chatMessage, timestamp, nextTimestamp) in enumerate(zip(chat_messages, timestamps, nextTimestamps)):
+        yield format_srt_line(
             index=index,
-            start_time_seconds=chatMessage.TimestampSeconds,
-            end_time_seconds=min(nextTimestampSeconds, chatMessage.TimestampSeconds + max_seconds_onscreen),
+            start_time_milliseconds=timestamp,
+            end_time_milliseconds=min(nextTimestamp, timestamp + maxMillisecondsOnscreen),
             author=chatMessage.Author,
             message_text=chatMessage.MessageText,
-            color=chatMessage.Color))
-    return srtLines
+            color=chatMessage.Color)
 
-def parse_ass_lines(chat_messages: List[ChatMessage], max_seconds_onscreen: float = 5, grouping_interval_seconds: float = 5, max_subtitles_onscreen: int = 5) -> List[AssLine]:
+def parse_ass_lines(chat_messages: List[ChatMessage], timestamps: 'array[int]', max_seconds_onscreen: float = 5, grouping_interval_seconds: float = 5, max_subtitles_onscreen: int = 5) -> Iterator[str]:
+    """Yields formatted subtitle lines one at a time, so that they can be written out without holding every line in memory."""
     if max_seconds_onscreen <= 0:
         raise ValueError(f'max_seconds_onscreen must be positive, but was {max_seconds_onscreen}')
     if grouping_interval_seconds <= 0:
         raise ValueError(f'grouping_interval_seconds must be positive, but was {grouping_interval_seconds}')
     if max_subtitles_onscreen <= 0:
         raise ValueError(f'max_subtitles_onscreen must be positive, but was {max_seconds_onscreen}')
-    assLines: List[AssLine] = []
-    if len(chat_messages) == 0:
-        return assLines
-    minTimestamp = 0
-    maxTimestamp = grouping_interval_seconds
-    lastTimestamp = chat_messages[-1].TimestampSeconds
+    if len(timestamps) == 0:
+        return
+    groupingIntervalMilliseconds = max(round(1000 * grouping_interval_seconds), 1)
+    maxMillisecondsOnscreen = round(1000 * max_seconds_onscreen)
+    messageCount = len(timestamps)
+    lastTimestamp = timestamps[-1]
     minIndex = 0
-    maxIndex = -1
-    while minTimestamp < lastTimestamp:
-        while maxIndex + 1 < len(chat_messages) and chat_messages[maxIndex + 1].TimestampSeconds < maxTimestamp:
-            maxIndex += 1
-        commentsInInterval = maxIndex - minIndex + 1
-        if commentsInInterval > 0:
-            subtitlesPerSecond = commentsInInterval / grouping_interval_seconds
-            for i in range(0, commentsInInterval):
-                chatMessage = chat_messages[minIndex + i]
-                timeOnscreen = min(max_subtitles_onscreen / subtitlesPerSecond, max_seconds_onscreen)
-                assLines.append(AssLine(
-                    start_time_seconds=chatMessage.TimestampSeconds,
-                    end_time_seconds=chatMessage.TimestampSeconds + timeOnscreen,
-                    author=chatMessage.Author,
-                    message_text=chatMessage.MessageText,
-                    color=chatMessage.Color))
-        minIndex = maxIndex + 1
-        minTimestamp += grouping_interval_seconds
-        maxTimestamp += grouping_interval_seconds
-    return assLines
+    while minIndex < messageCount:
+        # Jump straight to the interval containing the next message, and find where it ends with a binary search.
+        minTimestamp = max(timestamps[minIndex] // groupingIntervalMilliseconds, 0) * groupingIntervalMilliseconds
+        if minTimestamp >= lastTimestamp:
+            break
+        maxIndex = bisect_left(timestamps, minTimestamp + groupingIntervalMilliseconds, minIndex + 1)
+        commentsInInterval = maxIndex - minIndex
+        timeOnscreen = min(max_subtitles_onscreen * groupingIntervalMilliseconds // commentsInInterval, maxMillisecondsOnscreen)
+        for i in range(minIndex, maxIndex):
+            chatMessage = chat_messages[i]
+            timestamp = timestamps[i]
+            yield format_ass_line(
+                start_time_milliseconds=timestamp,
+                end_time_milliseconds=timestamp + timeOnscreen,
+                author=chatMessage.Author,
+                message_text=chatMessage.MessageText,
+                color=chatMessage.Color)
+        minIndex = maxIndex
+
+def write_lines(file, lines: Iterable[str], batch_size: int = 10000):
+    """Writes subtitle lines in batches, which needs far fewer write calls than writing each line, without holding the whole file in memory."""
+    lines = iter(lines)
+    while True:
+        batch = ''.join(islice(lines, batch_size))
+        if not batch:
+            break
+        file.write(batch)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -189,18 +204,17 @@ if __name__ == '__main__':
     args = parser.parse_args()
 
     chat = ChatDownloader().get_chat(args.url)
-    chatMessages = parse_chat_messages(chat)
-    even_spaced_timestamp_filter(chatMessages, args.smoothing_interval_seconds)
+    chatMessages, timestampsSeconds = parse_chat_messages(chat)
+    timestamps = even_spaced_timestamp_filter(timestampsSeconds, args.smoothing_interval_seconds)
 
     if args.command == 'srt':
-        lines = parse_srt_lines(chatMessages, args.max_seconds_onscreen)
+        lines = parse_srt_lines(chatMessages, timestamps, args.max_seconds_onscreen)
     elif args.command == 'ass':
-        lines = parse_ass_lines(chatMessages, args.max_seconds_onscreen, args.smoothing_interval_seconds, args.max_subtitles_onscreen)
+        lines = parse_ass_lines(chatMessages, timestamps, args.max_seconds_onscreen, args.smoothing_interval_seconds, args.max_subtitles_onscreen)
 
     filePath = os.path.join(os.getcwd(), f'{args.title}.{args.command}')
     with open(filePath, 'w', encoding='utf-8') as file:
         if args.command == 'ass':
             file.write(assHeader)
-        for line in lines:
-            file.write(line.to_string())
+        write_lines(file, lines)
         print(f'Wrote subtitles to {filePath}')
@@ -0,0 +1,53 @@
+import os
+import sys
+import unittest
+
+# Allow direct execution
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # noqa
+
+
+from chat_downloader.sites.common import Remapper as r
+
+
+class TestRemapper(unittest.TestCase):
+    """
+    Class used to run unit tests for remapping.
+    """
+
+    def test_flatten_dict(self):
+        remapping = {
+            'a': 'new_a',
+            'b': r('new_b', int),
+            'c': r(remap_function=dict, to_unpack=True),
+        }
+        self.assertEqual(r.flatten_dict(remapping), {
+            'a': ('new_a', None, False),
+            'b': ('new_b', int, False),
+            'c': (None, dict, True),
+        })
+
+        self.assertRaises(ValueError, r.flatten_dict, {'a': 1})
+
+    def test_flatten_dict_matches_remap(self):
+        remapping = {
+            'a': 'new_a',
+            'b': r('new_b', str),
+            'c': r(remap_function=lambda x: {'x': x, 'y': -x}, to_unpack=True),
+        }
+        data = {'a': 1, 'b': 2, 'c': 3, 'unknown': 4}
+
+        flattened = {}
+        for key, (new_key, remap_function, to_unpack) in r.flatten_dict(remapping).items():
+            if key not in data:
+                continue
+            value = remap_function(data[key]) if remap_function else data[key]
+            if to_unpack:
+                flattened.update(value)
+            else:
+                flattened[new_key] = value
+
+        self.assertEqual(flattened, r.remap_dict(data, remapping))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import sys
+import unittest
+from array import array
+
+# Allow direct execution
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # noqa
+
+
+from srt_subtitle_downloader import (
+    assTimestampTemplate,
+    even_spaced_timestamp_filter,
+    format_timestamp,
+    parse_chat_messages,
+    parse_srt_lines,
+    srtTimestampTemplate
+)
+
+
+class TestSrtSubtitleDownloader(unittest.TestCase):
+    """
+    Class used to run unit tests for the subtitle downloader script.
+    """
+
+    def test_format_srt_timestamp(self):
+        def srt(milliseconds):
+            return format_timestamp(milliseconds, 1, srtTimestampTemplate)
+
+        self.assertEqual(srt(0), '00:00:00,000')
+        self.assertEqual(srt(999), '00:00:00,999')
+        self.assertEqual(srt(3599999), '00:59:59,999')
+        self.assertEqual(srt(3661005), '01:01:01,005')
+        self.assertEqual(srt(99999995), '27:46:39,995')
+
+        # Negative timestamps (e.g. messages sent before a stream starts)
+        self.assertEqual(srt(-500), '-00:00:00,500')
+        self.assertEqual(srt(-3661005), '-01:01:01,005')
+
+    def test_format_ass_timestamp(self):
+        def ass(milliseconds):
+            return format_timestamp(milliseconds, 10, assTimestampTemplate)
+
+        self.assertEqual(ass(0), '0:00:00.00')
+        self.assertEqual(ass(3661004), '1:01:01.00')
+
+        # Ties round up, and carry into the seconds instead of overflowing
+        self.assertEqual(ass(40625), '0:00:40.63')
+        self.assertEqual(ass(995), '0:00:01.00')
+        self.assertEqual(ass(3599995), '1:00:00.00')
+
+        # Negative values round by magnitude
+        self.assertEqual(ass(-5), '-0:00:00.01')
+        self.assertEqual(ass(-3661005), '-1:01:01.01')
+
+    def test_timestamps_in_milliseconds(self):
+        chats = [
+            {'message': 'a', 'time_in_seconds': -3.2, 'author': {'name': 'x'}},
+            {'message': 'b', 'time_in_seconds': 0.9996, 'author': {'name': 'y', 'colour': '#123456'}},
+            {'message': 'c', 'time_in_seconds': 1.0004, 'author': {'name': 'z'}},
+        ]
+        messages, timestamps_seconds = parse_chat_messages(chats)
+        self.assertEqual(list(timestamps_seconds), [-3.2, 0.9996, 1.0004])
+        self.assertEqual([m.Color for m in messages], ['00FF00', '123456', '00FF00'])
+
+        # Evenly spaced within the first interval, rounded to the nearest millisecond
+        timestamps = even_spaced_timestamp_filter(timestamps_seconds, 10)
+        self.assertEqual(list(timestamps), [1667, 5000, 8333])
+
+        self.assertEqual(''.join(parse_srt_lines(messages, timestamps, 5)), (
+            '0\n00:00:01,667 --> 00:00:05,000\n<font color="#00FF00">x</font>: a\n\n'
+            '1\n00:00:05,000 --> 00:00:08,333\n<font color="#123456">y</font>: b\n\n'
+            '2\n00:00:08,333 --> 00:00:13,333\n<font color="#00FF00">z</font>: c\n\n'
+        ))
+
+    def test_smoothing_intervals(self):
+        def smooth(timestamps_seconds, smoothing_interval_seconds):
+            return list(even_spaced_timestamp_filter(array('d', timestamps_seconds), smoothing_interval_seconds))
+
+        self.assertEqual(smooth([], 1), [])
+        self.assertRaises(ValueError, smooth, [1], 0)
+
+        # Intervals are chosen before rounding, so a message just before
+        # the end of an interval stays in it
+        self.assertEqual(smooth([75.2, 75.999514, 77.3], 1), [75250, 75750, 77500])
+
+        # Messages at or after the start of the last interval are not smoothed
+        self.assertEqual(smooth([0.5, 10, 10], 10), [5000, 10000, 10000])
+
+
+if __name__ == '__main__':
+    unittest.main()
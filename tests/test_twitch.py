@@ -0,0 +1,103 @@
+import os
+import sys
+import unittest
+
+# Allow direct execution
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # noqa
+
+
+from chat_downloader.sites.twitch import TwitchChatDownloader, TwitchChatIRC
+
+
+class FakeSocket:
+    """Socket which returns predefined chunks of data from `recv`."""
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    def recv(self, buffer_size):
+        return self.chunks.pop(0) if self.chunks else b''
+
+
+def create_irc(chunks):
+    # Avoid connecting to the real server
+    irc = TwitchChatIRC.__new__(TwitchChatIRC)
+    irc.socket = FakeSocket(chunks)
+    irc._buffer = bytearray()
+    return irc
+
+
+class TestTwitch(unittest.TestCase):
+    """
+    Class used to run offline unit tests for the Twitch parsers.
+    """
+
+    def test_parse_irc_line(self):
+        parse = TwitchChatDownloader._parse_irc_line
+
+        # Message containing ' :' must not be split again
+        self.assertEqual(parse(
+            '@badges=premium/1;display-name=Foo;id=1 :foo!foo@foo.tmi.twitch.tv PRIVMSG #bar :hello :) world'),
+            ('badges=premium/1;display-name=Foo;id=1', 'PRIVMSG', 'hello :) world'))
+
+        self.assertEqual(parse(
+            '@login=foo;target-msg-id=abc :tmi.twitch.tv CLEARMSG #bar :what a great day'),
+            ('login=foo;target-msg-id=abc', 'CLEARMSG', 'what a great day'))
+
+        self.assertEqual(parse(
+            '@id=2 :foo!foo@foo.tmi.twitch.tv PRIVMSG #bar :\x01ACTION waves\x01'),
+            ('id=2', 'PRIVMSG', '\x01ACTION waves\x01'))
+
+        # No message
+        self.assertEqual(parse(
+            '@room-id=1;tmi-sent-ts=2 :tmi.twitch.tv CLEARCHAT #bar'),
+            ('room-id=1;tmi-sent-ts=2', 'CLEARCHAT', None))
+        self.assertEqual(parse(
+            '@emote-only=0;slow=0 :tmi.twitch.tv ROOMSTATE #bar'),
+            ('emote-only=0;slow=0', 'ROOMSTATE', None))
+        self.assertEqual(parse(
+            '@id=3 :foo!foo@foo.tmi.twitch.tv PRIVMSG #bar :'),
+            ('id=3', 'PRIVMSG', None))
+
+        # Lines without tags are ignored
+        self.assertIsNone(parse('PING :tmi.twitch.tv'))
+        self.assertIsNone(parse(':tmi.twitch.tv 001 justinfan67420 :Welcome, GLHF!'))
+        self.assertIsNone(parse('@only-tags'))
+        self.assertIsNone(parse(''))
+
+    def test_parse_irc_item(self):
+        info = TwitchChatDownloader._parse_irc_item(
+            *TwitchChatDownloader._parse_irc_line(
+                '@display-name=Foo;id=1;flagonly :foo!foo@foo.tmi.twitch.tv PRIVMSG #bar :hello world'))
+
+        self.assertEqual(info['message'], 'hello world')
+        self.assertEqual(info['message_id'], '1')
+        self.assertEqual(info['message_type'], 'text_message')
+        self.assertEqual(info['author']['display_name'], 'Foo')
+
+    def test_recv_lines(self):
+        irc = create_irc([
+            b'PING :tmi.twitch.tv\r\n:a!a@a PRIVMSG #b :one\r',  # split CRLF
+            b'\n:a!a@a PRIVMSG #b :tw',  # incomplete line
+            b'o\r\n',
+            b'\r\n',  # empty line
+        ])
+        self.assertEqual(irc.recv_lines(4096), ['PING :tmi.twitch.tv'])
+        self.assertEqual(irc.recv_lines(4096), [':a!a@a PRIVMSG #b :one'])
+        self.assertEqual(irc.recv_lines(4096), [':a!a@a PRIVMSG #b :two'])
+        self.assertEqual(irc.recv_lines(4096), [''])
+        self.assertRaises(ConnectionError, irc.recv_lines, 4096)
+
+    def test_recv_lines_split_characters(self):
+        data = 'héllo 😀 wörld\r\n'.encode('utf-8') * 2
+
+        # Split the data at every possible position, including within
+        # multibyte characters
+        for i in range(1, len(data)):
+            irc = create_irc([data[:i], data[i:]])
+            lines = irc.recv_lines(4096) + irc.recv_lines(4096)
+            self.assertEqual(lines, ['héllo 😀 wörld'] * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,7 +8,8 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from chat_downloader.utils.core import (
     safe_print,
-    get_title_of_webpage
+    get_title_of_webpage,
+    json_loads
 )
 from chat_downloader.utils.timed_utils import timed_input
 
@@ -29,6 +30,15 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(get_title_of_webpage(
             'a <title>title</title> b'), 'title')
 
+    def test_json_loads(self):
+        self.assertEqual(json_loads('{"a": [1, "b"]}'), {'a': [1, 'b']})
+        self.assertEqual(json_loads(b'{"a": [1, "b"]}'), {'a': [1, 'b']})
+
+        # UTF-8 byte order mark
+        self.assertEqual(json_loads(b'\xef\xbb\xbf{"a": 1}'), {'a': 1})
+
+        self.assertRaises(ValueError, json_loads, b'{"a": ')
+
     def test_timed_input(self):
         if os.name == 'nt':  # only test on windows
             self.assertEqual(timed_input(5, 'Enter:'), None)